@@ -0,0 +1,333 @@
+"""
+End-to-end benchmark of build_modrepo.main() against a local stand-in for GitHub.
+
+A child process serves a synthetic /releases listing and zip assets over
+HTTP/1.1. The build runs in a temporary directory with a cache that already
+knows a given share of the assets. Reports wall time, bytes served and peak
+RSS per phase of main(). Downloads start while the listing is still paged
+through, so "list releases" includes some of their traffic:
+
+    python benchmarks/bench_build.py --releases 200 --asset-size 4MiB --hit-ratio 0.5 -- --jobs 16
+
+Arguments after "--" are passed on to build_modrepo. To see what reusing
+connections saves per asset, compare against fresh connections:
+
+    python benchmarks/bench_build.py --connect-latency 50 -- --jobs 4
+    python benchmarks/bench_build.py --connect-latency 50 -- --jobs 4 --no-keep-alive
+
+With --throttle the first request for every URL is refused with 429 and
+Retry-After, as by a secondary rate limit. The build has to wait and retry:
+
+    python benchmarks/bench_build.py --releases 10 --throttle -- --retries 1
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import build_modrepo  # noqa: E402
+
+REPOSITORY = "bench/modrepo"
+ZIP_DATE = (2020, 1, 1, 0, 0, 0)
+
+
+def about_xml(index: int) -> str:
+    return (
+        "<ModMetadata>"
+        f"<ModID>bench.mod{index % 50}</ModID>"
+        f"<Version>1.{index}.0</Version>"
+        f"<Name>Benchmark mod {index}</Name>"
+        "<Author>bench</Author>"
+        f"<Branch>b{index % 3}</Branch>"
+        "</ModMetadata>"
+    )
+
+
+@lru_cache(maxsize=1)
+def payload(size: int) -> bytes:
+    return random.Random(size).randbytes(size)
+
+
+@lru_cache(maxsize=16)
+def make_zip(index: int, size: int) -> bytes:
+    """
+    Asset number index: an incompressible payload of size bytes followed by About/About.xml.
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr(zipfile.ZipInfo("Textures/payload.bin", ZIP_DATE), payload(size))
+        zf.writestr(
+            zipfile.ZipInfo("About/About.xml", ZIP_DATE),
+            about_xml(index),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+    return buf.getvalue()
+
+
+def make_releases(args) -> list[dict]:
+    releases = []
+    for r in range(args.releases):
+        assets = []
+        for a in range(args.assets_per_release):
+            index = r * args.assets_per_release + a
+            data = make_zip(index, args.asset_size)
+            assets.append(
+                {
+                    "id": index,
+                    "name": f"mod{index}.zip",
+                    "digest": "sha256:" + hashlib.sha256(data).hexdigest(),
+                    "size": len(data),
+                    "download_count": 0,
+                }
+            )
+        releases.append({"id": r, "tag_name": f"v{r}", "assets": assets})
+    return releases
+
+
+def serve(args, ready, bytes_sent, requests_served):
+    """
+    Runs in the server process until it is terminated. Puts the port and the
+    releases on the ready queue once it is listening, the assets are only
+    ever built in this process to keep them out of the RSS of the build.
+    """
+    releases = make_releases(args)
+    throttled = set()
+    throttled_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def setup(self):
+            # stands in for TCP and TLS handshakes on a new connection
+            time.sleep(args.connect_latency / 1000)
+            super().setup()
+
+        def respond(self, status: int, body: bytes, headers: dict):
+            time.sleep(args.latency / 1000)
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            view = memoryview(body)
+            for pos in range(0, len(body), 1 << 20):
+                self.wfile.write(view[pos : pos + (1 << 20)])
+            with bytes_sent.get_lock():
+                bytes_sent.value += len(body)
+            with requests_served.get_lock():
+                requests_served.value += 1
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if args.throttle:
+                with throttled_lock:
+                    first = self.path not in throttled
+                    throttled.add(self.path)
+                if first:
+                    return self.respond(429, b"", {"Retry-After": "1"})
+            base = f"http://{self.headers['Host']}"
+            if url.path == f"/repos/{REPOSITORY}/releases":
+                return self.listing(base, parse_qs(url.query))
+            m = re.fullmatch(r"/download/(\d+)/mod\d+\.zip", url.path)
+            if m and int(m.group(1)) < args.releases * args.assets_per_release:
+                return self.asset(int(m.group(1)))
+            self.respond(404, b"", {})
+
+        def listing(self, base: str, query: dict):
+            per_page = min(int(query.get("per_page", ["30"])[0]), 100)
+            page = int(query.get("page", ["1"])[0])
+            data = releases[(page - 1) * per_page : page * per_page]
+            for rel in data:
+                for asset in rel["assets"]:
+                    asset["browser_download_url"] = (
+                        f"{base}/download/{asset['id']}/{asset['name']}"
+                    )
+            body = json.dumps(data).encode()
+            headers = {
+                "Content-Type": "application/json",
+                "ETag": '"' + hashlib.sha1(body).hexdigest() + '"',
+                "X-RateLimit-Remaining": "5000",
+            }
+            if page * per_page < len(releases):
+                headers["Link"] = (
+                    f'<{base}/repos/{REPOSITORY}/releases?per_page={per_page}&page={page + 1}>;'
+                    ' rel="next"'
+                )
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                return self.respond(304, b"", headers)
+            self.respond(200, body, headers)
+
+        def asset(self, index: int):
+            data = make_zip(index, args.asset_size)
+            m = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+            if not m or args.no_range:
+                return self.respond(200, data, {"Content-Type": "application/zip"})
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2) or len(data) - 1), len(data) - 1)
+            else:
+                start, end = max(0, len(data) - int(m.group(2))), len(data) - 1
+            self.respond(
+                206,
+                data[start : end + 1],
+                {"Content-Range": f"bytes {start}-{end}/{len(data)}"},
+            )
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    ready.put((server.server_port, releases))
+    server.serve_forever()
+
+
+class BenchMetrics(build_modrepo.Metrics):
+    """
+    Adds the bytes served, requests and peak RSS to every phase.
+    """
+
+    def __init__(self, bytes_sent, requests_served):
+        super().__init__()
+        self.bytes_sent = bytes_sent
+        self.requests_served = requests_served
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        sent, served = self.bytes_sent.value, self.requests_served.value
+        with super().phase(name):
+            yield
+        self.phases[name].update(
+            bytes=self.bytes_sent.value - sent,
+            requests=self.requests_served.value - served,
+            max_rss_kib=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+
+def seed_cache(releases: list[dict], hit_ratio: float, base: str):
+    """
+    Store the metadata of a random hit_ratio share of the assets in the cache.
+    """
+    assets = [a for rel in releases for a in rel["assets"]]
+    hits = random.Random(0).sample(assets, round(len(assets) * hit_ratio))
+    cache = build_modrepo.MetadataCache(Path("modrepo_cache.db"))
+    for asset in hits:
+        mm = build_modrepo.ModMetadata.from_about_xml(
+            about_xml(asset["id"]), f"{base}/download/{asset['id']}/{asset['name']}", asset["digest"]
+        )
+        cache[asset["digest"]] = mm.to_cache()
+    cache.commit()
+    cache.close()
+
+
+def parse_size(s: str) -> int:
+    m = re.fullmatch(r"(\d+)\s*([KMG]i?B?)?", s.strip(), re.IGNORECASE)
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid size: {s}")
+    unit = (m.group(2) or "").upper()[:1]
+    return int(m.group(1)) * {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}[unit]
+
+
+def main():
+    argv = sys.argv[1:]
+    build_args = []
+    if "--" in argv:
+        argv, build_args = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--releases", type=int, default=100)
+    parser.add_argument("--assets-per-release", type=int, default=1)
+    parser.add_argument("--asset-size", type=parse_size, default="1MiB")
+    parser.add_argument(
+        "--hit-ratio", type=float, default=0.0, help="share of assets already in the cache"
+    )
+    parser.add_argument("--latency", type=float, default=0, help="ms added to every response")
+    parser.add_argument(
+        "--connect-latency", type=float, default=0, help="ms added to every new connection"
+    )
+    parser.add_argument(
+        "--no-range", action="store_true", help="ignore Range headers on asset downloads"
+    )
+    parser.add_argument(
+        "--throttle",
+        action="store_true",
+        help="answer the first request for every URL with 429 and Retry-After",
+    )
+    parser.add_argument("--verbose", action="store_true", help="show the output of the build")
+    args = parser.parse_args(argv)
+
+    ready = multiprocessing.Queue()
+    bytes_sent = multiprocessing.Value("q", 0)
+    requests_served = multiprocessing.Value("q", 0)
+    server = multiprocessing.Process(
+        target=serve, args=(args, ready, bytes_sent, requests_served), daemon=True
+    )
+    server.start()
+    port, releases = ready.get()
+
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update(GITHUB_API_URL=base, GITHUB_REPOSITORY=REPOSITORY)
+    os.environ.pop("GH_TOKEN", None)
+    os.environ.pop("GITHUB_TOKEN", None)
+
+    metrics = BenchMetrics(bytes_sent, requests_served)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            seed_cache(releases, args.hit_ratio, base)
+            output = sys.stdout if args.verbose else io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                build_modrepo.main(build_args, metrics)
+            total = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    server.terminate()
+
+    count = args.releases * args.assets_per_release
+    print(
+        f"{count} assets of {args.asset_size:,} bytes, hit ratio {args.hit_ratio:.0%},"
+        f" build args: {' '.join(build_args) or '(none)'}"
+    )
+    print(f"{'phase':<20}{'seconds':>10}{'requests':>10}{'MiB sent':>12}{'peak RSS MiB':>14}")
+    for name, phase in metrics.phases.items():
+        print(
+            f"{name:<20}{phase['seconds']:>10.3f}{phase['requests']:>10}"
+            f"{phase['bytes'] / (1 << 20):>12.1f}{phase['max_rss_kib'] / 1024:>14.1f}"
+        )
+    print(
+        f"{'total':<20}{total:>10.3f}{requests_served.value:>10}"
+        f"{bytes_sent.value / (1 << 20):>12.1f}"
+    )
+    downloads = [a["download_seconds"] for a in metrics.assets if a["download_seconds"]]
+    if downloads:
+        downloads.sort()
+        print(
+            f"per download: {sum(downloads) / len(downloads) * 1000:.1f} ms mean,"
+            f" {downloads[len(downloads) // 2] * 1000:.1f} ms median"
+        )
+    retries = sum(a["retries"] for a in metrics.assets)
+    if retries:
+        print(f"download retries: {retries}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Memory benchmark for the ModMetadata entries a build holds until modrepo.xml is written.
+
+Compares ModMetadata with the previous implementation (a dataclass with a
+per-instance __dict__, lists for branch/tag/depends_on, no interning, cached
+as a dict of its fields) on synthetic entries loaded from cache values:
+
+    python benchmarks/bench_metadata_memory.py [--count 50000]
+"""
+
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import build_modrepo  # noqa: E402
+
+
+@dataclass
+class LegacyModMetadata:
+    id: str
+    version: str
+    name: str
+    author: str
+    url: str
+    digest: str
+
+    branch: list[str]
+    tag: list[str]
+    depends_on: list[str]
+
+
+def synthetic_entries(count: int, seed: int = 0) -> list[dict]:
+    """
+    Field dicts shaped like the ones of a large repository: few mods with
+    many versions each, a handful of authors and branches.
+    """
+    rnd = random.Random(seed)
+    mods = [f"author{rnd.randrange(count // 200 + 1)}.mod{i}" for i in range(count // 50 + 1)]
+    entries = []
+    for i in range(count):
+        mod_id = rnd.choice(mods)
+        digest = "sha256:" + rnd.randbytes(32).hex()
+        entries.append(
+            {
+                "id": mod_id,
+                "version": f"{rnd.randint(0, 9)}.{rnd.randint(0, 30)}.{i}",
+                "name": f"Mod {mod_id.split('.')[1]}",
+                "author": mod_id.split(".")[0],
+                "url": f"https://github.com/o/r/releases/download/v{i}/{mod_id}.zip",
+                "digest": digest,
+                "branch": rnd.sample(["main", "stable", "beta", "1.5", "1.6"], rnd.randint(1, 3)),
+                "tag": rnd.sample(["QoL", "UI", "Content", "Library"], rnd.randint(0, 2)),
+                "depends_on": rnd.sample(mods, rnd.randint(0, 2)),
+            }
+        )
+    return entries
+
+
+def measure(label: str, load, values: list[str], urls: list[str]) -> int:
+    """
+    Memory held after loading every cache value with load, as a build does on
+    cache hits. urls stand in for the asset urls of the release listing.
+    """
+    tracemalloc.start()
+    entries = [load(json.loads(v), url) for v, url in zip(values, urls)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {size / (1 << 20):9.1f} MiB  ({size / len(entries):,.0f} bytes/entry)")
+    del entries
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=50_000)
+    args = parser.parse_args()
+
+    fields = synthetic_entries(args.count)
+    legacy_values = [json.dumps(f, sort_keys=True) for f in fields]
+    values = [
+        json.dumps(build_modrepo.ModMetadata(**f).to_cache(), sort_keys=True) for f in fields
+    ]
+    urls = [f["url"] for f in fields]
+    print(f"{len(fields):,} entries")
+
+    # the legacy class took the url from the cache value
+    legacy = measure("legacy", lambda d, url: LegacyModMetadata(**d), legacy_values, urls)
+    current = measure("slotted", build_modrepo.ModMetadata.from_cache, values, urls)
+    print(f"memory: {legacy / current:.1f}x smaller")
+
+    legacy_bytes = sum(len(v) for v in legacy_values)
+    current_bytes = sum(len(v) for v in values)
+    print(
+        f"cache values: {legacy_bytes / (1 << 20):.1f} MiB legacy,"
+        f" {current_bytes / (1 << 20):.1f} MiB compact"
+    )
+
+    for f, v in zip(fields, values):
+        mm = build_modrepo.ModMetadata.from_cache(json.loads(v), f["url"])
+        assert mm == build_modrepo.ModMetadata.from_cache(f, f["url"]), f
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark for the version sort keys used to order modrepo.xml.
+
+Compares parse_version with the previous implementation (regexes compiled on
+every call, lists instead of tuples, no memo) on synthetic version strings:
+
+    python benchmarks/bench_parse_version.py [--count 100000]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import build_modrepo  # noqa: E402
+
+
+def legacy_parse_version(s):
+    s = s.strip()
+    if not s:
+        return [[("", 0, "")]]
+
+    if s[0] in "vV":
+        s = s[1:]
+
+    def _cmp_key_str(x: str) -> str:
+        return (x or "").casefold()
+
+    def _parse_part(part: str) -> tuple[str, int, str]:
+        part = part or ""
+        if not part:
+            return ("", 0, "")
+
+        if part[0].isdigit():
+            m = re.match(r"^(\d+)(.*)$", part)
+            if m:
+                num_s, suffix = m.group(1), m.group(2)
+                num = int(num_s) if num_s else 0
+                return ("", num, _cmp_key_str(suffix))
+            return ("", 0, "")
+
+        m = re.match(r"^(.*?)(\d+)?$", part)
+        if m:
+            prefix, num_s = m.group(1), m.group(2)
+            num = int(num_s) if num_s else 0
+            return (_cmp_key_str(prefix), num, "")
+        return (_cmp_key_str(part), 0, "")
+
+    sections: list[list[tuple[str, int, str]]] = []
+    for section in s.split("."):
+        parts = [_parse_part(p) for p in section.split("-")]
+        sections.append(parts)
+
+    return sections
+
+
+def synthetic_versions(count: int, seed: int = 0) -> list[str]:
+    """
+    Version strings shaped like the ones found in About.xml files: mostly
+    numeric, some with a v prefix or pre-release suffix, many repeated across
+    branches and re-uploads.
+    """
+    rnd = random.Random(seed)
+    suffixes = ["", "", "", "-beta", "-rc1", "-RC2", "a", "-dev-3"]
+    distinct = []
+    for _ in range(max(1, count // 4)):
+        parts = [str(rnd.randint(0, 30)) for _ in range(rnd.randint(2, 4))]
+        distinct.append(rnd.choice(["", "", "v", "V"]) + ".".join(parts) + rnd.choice(suffixes))
+    return [rnd.choice(distinct) for _ in range(count)]
+
+
+def bench(label: str, key, versions: list[str]) -> tuple[float, list[str]]:
+    start = time.perf_counter()
+    ordered = sorted(versions, key=key)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed * 1000:9.1f} ms  ({len(versions) / elapsed:,.0f} keys/s)")
+    return elapsed, ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=100_000)
+    args = parser.parse_args()
+
+    versions = synthetic_versions(args.count)
+    print(f"sorting {len(versions):,} version strings")
+
+    legacy, legacy_order = bench("legacy", legacy_parse_version, versions)
+    build_modrepo.parse_version.cache_clear()
+    cold, order = bench("cold", build_modrepo.parse_version, versions)
+    warm, _ = bench("warm", build_modrepo.parse_version, versions)
+
+    assert order == legacy_order, "sort order differs from the legacy implementation"
+    for v in set(versions):
+        legacy_key = tuple(tuple(section) for section in legacy_parse_version(v))
+        assert build_modrepo.parse_version(v) == legacy_key, v
+    print(f"speedup: {legacy / cold:.1f}x cold, {legacy / warm:.1f}x warm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Checks that builds under different PYTHONHASHSEED values write identical bytes.
+
+Runs build_modrepo.py from scratch once per seed, in a fresh directory and
+against the local stand-in for GitHub of bench_build.py, whose mods declare
+several branches each. Every file the builds leave behind (modrepo.xml, its
+compressed copies, the cache, shards and delta feed) must be the same:
+
+    python benchmarks/check_stable_output.py [--seeds 1 2 3] [-- --jobs 16]
+
+Arguments after "--" are passed on to build_modrepo. Exits with status 1 and
+lists the files that differ otherwise.
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import bench_build
+
+SCRIPT = Path(__file__).resolve().parent.parent / "build_modrepo.py"
+BUILD_ARGS = ["--jobs", "8", "--shards", "mods", "--delta-feed", "modrepo.changes.jsonl"]
+
+
+_about_xml = bench_build.about_xml
+
+
+def about_xml(index: int) -> str:
+    # several branches per mod, in an order a set would not keep
+    branches = "".join(f"<Branch>b{(index + i) % 5}</Branch>" for i in (3, 0, 4, 1))
+    return _about_xml(index).replace(f"<Branch>b{index % 3}</Branch>", branches)
+
+
+def build(seed: str, base: str, build_args: list[str]) -> dict[str, bytes]:
+    """
+    Runs a build from scratch with PYTHONHASHSEED=seed and returns the files it wrote.
+    """
+    env = dict(os.environ, PYTHONHASHSEED=seed)
+    env.update(GITHUB_API_URL=base, GITHUB_REPOSITORY=bench_build.REPOSITORY)
+    for name in ("GH_TOKEN", "GITHUB_TOKEN", "GITHUB_OUTPUT"):
+        env.pop(name, None)
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run(
+            [sys.executable, str(SCRIPT), *build_args],
+            cwd=tmp,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        return {
+            str(path.relative_to(tmp)): path.read_bytes()
+            for path in sorted(Path(tmp).rglob("*"))
+            if path.is_file()
+        }
+
+
+def main():
+    argv = sys.argv[1:]
+    build_args = BUILD_ARGS
+    if "--" in argv:
+        argv, build_args = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seeds", nargs="+", default=["1", "2", "3"])
+    parser.add_argument("--releases", type=int, default=60)
+    parser.add_argument("--assets-per-release", type=int, default=2)
+    args = parser.parse_args(argv)
+    server_args = argparse.Namespace(
+        releases=args.releases,
+        assets_per_release=args.assets_per_release,
+        asset_size=4096,
+        latency=0,
+        connect_latency=0,
+        no_range=False,
+        throttle=False,
+    )
+
+    # the server runs in a thread of this process, so that it serves about_xml
+    bench_build.about_xml = about_xml
+    ready = queue.Queue()
+    counters = multiprocessing.Value("q", 0), multiprocessing.Value("q", 0)
+    threading.Thread(
+        target=bench_build.serve, args=(server_args, ready, *counters), daemon=True
+    ).start()
+    port, _ = ready.get()
+    base = f"http://127.0.0.1:{port}"
+
+    first, *others = args.seeds
+    expected = build(first, base, build_args)
+    different = set()
+    for seed in others:
+        files = build(seed, base, build_args)
+        different |= {
+            name for name in expected.keys() | files.keys() if expected.get(name) != files.get(name)
+        }
+
+    print(
+        f"{len(expected)} files from {len(args.seeds)} builds,"
+        f" build args: {' '.join(build_args)}"
+    )
+    for name in sorted(different):
+        print(f"differs between seeds: {name}")
+    sys.exit(1 if different else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,56 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import gzip
 import hashlib
+import io
+import itertools
 import json
+import mmap
 import os
 import re
-import subprocess
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
 import zipfile
+import zlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from typing import BinaryIO, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.retry import Retry
 
+ABOUT_XML = "About/About.xml"
 
-@dataclass
+# releases requested per page from the GitHub API
+PER_PAGE = 100
+
+# downloads larger than this (or of unknown size) go to a temporary file instead of memory
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# seconds before the first retry of a download, doubled for every further one
+RETRY_BACKOFF = 1.0
+
+# partial downloads in the blob store that were not continued for this long are removed
+PARTIAL_MAX_AGE = 24 * 60 * 60
+
+# guards the shared cache and digest set while assets are handled concurrently
+_cache_lock = threading.Lock()
+# digest -> Future of its cache value, for assets that are being fetched right now
+_in_flight: dict[str, Future] = {}
+
+
+@dataclass(slots=True)
 class ModMetadata:
     id: str
     version: str
@@ -20,9 +59,19 @@ class ModMetadata:
     url: str
     digest: str
 
-    branch: list[str]
-    tag: list[str]
-    depends_on: list[str]
+    branch: tuple[str, ...]
+    tag: tuple[str, ...]
+    depends_on: tuple[str, ...]
+
+    def __post_init__(self):
+        # ids, authors and branches repeat across versions, store every distinct one once
+        self.id = sys.intern(self.id)
+        self.author = sys.intern(self.author)
+        # sorted and unique, also for entries cached before branches were sorted,
+        # so that modrepo.xml does not depend on set order (PYTHONHASHSEED)
+        self.branch = tuple(sorted({sys.intern(b) for b in self.branch}))
+        self.tag = tuple(self.tag)
+        self.depends_on = tuple(self.depends_on)
 
     @staticmethod
     def from_about_xml(elem: str | ET.Element | Path, url: str, digest: str):
@@ -57,8 +106,36 @@ class ModMetadata:
             digest=digest,
         )
 
+    def to_cache(self) -> list:
+        """
+        Compact cache value, the fields in declaration order. The url is left
+        empty: it belongs to the asset, and the same archive can be attached
+        to several releases, see from_cache().
+        """
+        return [
+            self.id,
+            self.version,
+            self.name,
+            self.author,
+            "",
+            self.digest,
+            list(self.branch),
+            list(self.tag),
+            list(self.depends_on),
+        ]
+
+    @staticmethod
+    def from_cache(value: list | dict, url: str) -> "ModMetadata":
+        """
+        The ModMetadata of a cache value for the asset at url.
+        """
+        # caches written before to_cache() hold dicts of the fields
+        mm = ModMetadata(**value) if isinstance(value, dict) else ModMetadata(*value)
+        mm.url = url
+        return mm
+
     @property
-    def version_parsed(self):
+    def version_parsed(self) -> "VersionKey":
         return parse_version(self.version)
 
     @staticmethod
@@ -74,7 +151,7 @@ class ModMetadata:
             for d in elem.findall("DependsOn")
         ]
         depends_on = [d for d in depends if d]
-        branch = list(set([b.text or "" for b in elem.findall("Branch")]))
+        branch = [b.text or "" for b in elem.findall("Branch")]
 
         return {"tag": tag, "depends_on": depends_on, "branch": branch}
 
@@ -87,92 +164,908 @@ class ModMetadata:
         return ET.tostring(elem, encoding="unicode")
 
 
-def github(args: list[str]) -> object:
-    out = subprocess.check_output(
-        ["gh", *args],
-        stderr=subprocess.PIPE,
-        text=True,
-    ).strip()
-    return json.loads(out) if out else []
+class MetadataCache:
+    """
+    Asset metadata keyed by digest, stored in SQLite.
+
+    Values are ModMetadata.to_cache() lists (dicts of the fields in older
+    caches), False for zip files that contain no About.xml, or the error
+    message of zip files that cannot be read as a mod or do not match
+    their digest. Changes are written
+    in one transaction by commit().
+
+    New values are held back until commit() and then inserted ordered by
+    digest, so the database file does not depend on the order in which
+    concurrent downloads finished.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS assets (digest TEXT PRIMARY KEY, metadata TEXT NOT NULL)"
+            " WITHOUT ROWID"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS release_pages"
+            " (page INTEGER PRIMARY KEY, etag TEXT NOT NULL, releases TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+        self._new: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        self._flush()
+        return self.db.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+    def get(self, digest: str, default=None) -> list | dict | bool | str | None:
+        if digest in self._new:
+            return json.loads(self._new[digest])
+        row = self.db.execute(
+            "SELECT metadata FROM assets WHERE digest = ?", (digest,)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __setitem__(self, digest: str, metadata: list | dict | bool | str):
+        self._new[digest] = json.dumps(metadata, sort_keys=True)
+
+    def _flush(self):
+        self.db.executemany(
+            "INSERT INTO assets (digest, metadata) VALUES (?, ?)"
+            " ON CONFLICT (digest) DO UPDATE SET metadata = excluded.metadata",
+            sorted(self._new.items()),
+        )
+        self._new.clear()
+
+    def prune(self, keep: set[str]) -> int:
+        """
+        Delete all entries whose digest is not in keep, returns the number of deleted entries.
+        """
+        self._flush()
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS keep (digest TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM keep")
+        self.db.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((d,) for d in keep))
+        cur = self.db.execute("DELETE FROM assets WHERE digest NOT IN (SELECT digest FROM keep)")
+        return cur.rowcount
+
+    def get_page(self, page: int) -> tuple[str, list] | None:
+        """
+        Returns the stored ETag and releases of a page of the release listing.
+        """
+        row = self.db.execute(
+            "SELECT etag, releases FROM release_pages WHERE page = ?", (page,)
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def set_page(self, page: int, etag: str, releases: list):
+        self.db.execute(
+            "INSERT OR REPLACE INTO release_pages (page, etag, releases) VALUES (?, ?, ?)",
+            (page, etag, json.dumps(releases, sort_keys=True)),
+        )
+
+    def truncate_pages(self, count: int) -> int:
+        """
+        Forget stored pages after the first count, returns the number of removed pages.
+        """
+        return self.db.execute("DELETE FROM release_pages WHERE page > ?", (count,)).rowcount
+
+    def get_state(self, key: str) -> str | None:
+        row = self.db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str | None):
+        if value is None:
+            self.db.execute("DELETE FROM state WHERE key = ?", (key,))
+        else:
+            self.db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate_json(self, json_file: Path):
+        """
+        One-shot import of the former modrepo_cache.json, which is removed afterwards.
+        """
+        data = json.loads(json_file.read_text())
+        print(f"Migrating {len(data)} entries from {json_file} to {self.path}")
+        for digest, metadata in data.items():
+            self[digest] = metadata
+        self.commit()
+        json_file.unlink()
+
+    def commit(self):
+        self._flush()
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class BlobStore:
+    """
+    Content-addressed store of downloaded archives, <root>/sha256/<hex digest>.
+
+    Unless verify is False, blobs are checked against their digest before
+    reuse. evict() removes the least recently used blobs until the store fits
+    into max_size bytes.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_size: int,
+        hash_pool: Executor | None = None,
+        verify: bool = True,
+    ):
+        self.root = root
+        self.max_size = max_size
+        self.hash_pool = hash_pool
+        self.verify = verify
+
+    def path(self, digest: str) -> Path | None:
+        m = re.fullmatch(r"sha256:([0-9a-f]{64})", digest)
+        return self.root / "sha256" / m.group(1) if m else None
+
+    def open(self, digest: str) -> BinaryIO | None:
+        """
+        Returns the stored blob for digest opened for reading, None if it is
+        missing or does not match the digest.
+        """
+        path = self.path(digest)
+        if not path or not path.exists():
+            return None
+        fp = path.open("rb")
+        if self.verify and sha256(fp, self.hash_pool) != digest:
+            print(f"\tstored blob {path} is corrupt, removing it")
+            fp.close()
+            path.unlink(missing_ok=True)
+            return None
+        fp.seek(0)
+        os.utime(path)  # mark as recently used
+        return fp
+
+    @contextlib.contextmanager
+    def add(self, digest: str) -> Iterator[BinaryIO]:
+        """
+        Yields a file to write the blob for digest to, it is stored when the
+        block finishes without an exception.
+
+        The file is <blob>.partial and starts with what an earlier attempt left
+        there. It is kept when the block fails with a network error, so the
+        next attempt can continue the download, and removed on other errors.
+        """
+        path = self.path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".partial")
+        try:
+            with partial.open("a+b") as fp:
+                yield fp
+            partial.replace(path)
+        except requests.RequestException:
+            raise
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used blobs beyond max_size and partial
+        downloads older than PARTIAL_MAX_AGE, returns the number of removed blobs.
+        """
+        blobs = []
+        for path in self.root.glob("sha256/*"):
+            st = path.stat()
+            if not path.name.endswith(".partial"):
+                blobs.append((st.st_mtime, st.st_size, path))
+            elif st.st_mtime < time.time() - PARTIAL_MAX_AGE:
+                # abandoned download, e.g. of an asset that was deleted meanwhile
+                path.unlink(missing_ok=True)
+        blobs.sort(reverse=True)
+        total = 0
+        removed = 0
+        for _, size, path in blobs:
+            total += size
+            if total > self.max_size:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+@dataclass
+class FetchOptions:
+    """
+    How assets that are not in the cache are fetched.
+    """
+
+    remote_zip: bool = False
+    blobs: BlobStore | None = None
+    hash_pool: Executor | None = None
+    # "verify" downloads against the digest from the release listing, "trust" it without hashing
+    digest_mode: str = "verify"
+    retries: int = 3
+    # shared by all download threads to reuse connections, a new connection per request if None
+    session: requests.Session | None = None
+
+
+class InvalidAssetError(Exception):
+    """
+    The archive of an asset cannot be read as a mod. This is cached by
+    digest, the archive is not downloaded again.
+    """
+
+
+class DigestMismatchError(InvalidAssetError):
+    """
+    A downloaded asset does not match the digest from the release listing.
+    """
+
+
+# errors reading an archive and its About.xml that a new attempt would run into
+# again, zipfile raises RuntimeError for encrypted and NotImplementedError for
+# unsupported entries
+_INVALID_ASSET_ERRORS = (
+    zipfile.BadZipFile,
+    zlib.error,
+    EOFError,
+    RuntimeError,
+    NotImplementedError,
+    ET.ParseError,
+    ValueError,
+)
+
+
+@contextlib.contextmanager
+def _reading_archive():
+    """
+    Raises InvalidAssetError for the errors of reading an archive, only for
+    the parsing wrapped in it, so that e.g. requests' ValueErrors are not
+    taken for a broken archive.
+    """
+    try:
+        yield
+    except _INVALID_ASSET_ERRORS as e:
+        raise InvalidAssetError(f"{type(e).__name__}: {e}") from e
+
+
+def make_session(
+    pool_size: int = 10, retries: int = 0, keep_alive: bool = True
+) -> requests.Session:
+    """
+    A requests.Session to share between threads, keeping up to pool_size
+    connections per host alive for reuse. Failed connection attempts are
+    retried up to retries times with exponential backoff, failures after a
+    request was sent and error responses, also those with Retry-After, are
+    left to the caller.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=RETRY_BACKOFF,
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
 
 
-def sha256(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+class GitHubClient:
+    """
+    Minimal client for the GitHub REST API on a pooled requests.Session.
+
+    The API headers are sent with every request instead of being set on the
+    session, which may be shared with asset downloads.
+    """
+
+    def __init__(
+        self,
+        token: str | None = None,
+        api_url: str | None = None,
+        session: requests.Session | None = None,
+    ):
+        self.api_url = api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+        self.session = session or make_session()
+        self.headers = {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        token = token or os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN")
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self._wait_until = 0.0
+
+    def get(self, url: str, etag: str | None = None, retries: int = 3) -> requests.Response:
+        """
+        GET url, which may be relative to the API root. With etag the request
+        is conditional, check for status 304 (Not Modified).
+
+        Waits for the rate limit to reset when it is exhausted.
+        """
+        if url.startswith("/"):
+            url = self.api_url + url
+        headers = dict(self.headers)
+        if etag:
+            headers["If-None-Match"] = etag
+        for attempt in range(retries + 1):
+            delay = self._wait_until - time.time()
+            if delay > 0:
+                print(f"GitHub API rate limit exhausted, waiting {delay:.0f}s")
+                time.sleep(delay)
+
+            r = self.session.get(url, headers=headers, timeout=30)
+            self._update_rate_limit(r)
+            if r.status_code in (403, 429) and self._wait_until > time.time() and attempt < retries:
+                continue
+            if r.status_code != 304:
+                r.raise_for_status()
+            return r
+
+    def _update_rate_limit(self, r: requests.Response):
+        if "Retry-After" in r.headers:
+            self._wait_until = time.time() + int(r.headers["Retry-After"])
+        elif r.headers.get("X-RateLimit-Remaining") == "0":
+            self._wait_until = int(r.headers.get("X-RateLimit-Reset", 0)) + 1
+
+
+class ReleaseListing:
+    """
+    Iterates over the releases of a repository, one page at a time.
+
+    Every page is requested with the ETag stored in the cache, pages that
+    come back as 304 Not Modified are taken from the cache. After iterating,
+    fingerprint is a hash over the release ids and the name, url and digest
+    of their assets.
+    """
+
+    def __init__(self, client: GitHubClient, cache: MetadataCache, repository: str):
+        self.client = client
+        self.cache = cache
+        self.repository = repository
+        self.fingerprint: str | None = None
+        self.count = 0
+
+    def __iter__(self) -> Iterator[dict]:
+        self.fingerprint = None
+        self.count = 0
+        # seeded with the source of this script, so that a changed builder rebuilds
+        h = hashlib.sha256(Path(__file__).read_bytes())
+        path = f"/repos/{self.repository}/releases?per_page={PER_PAGE}"
+        url: str | None = f"{path}&page=1"
+        page = 0
+        while url:
+            page += 1
+            with _cache_lock:
+                etag, stored = self.cache.get_page(page) or (None, None)
+            r = self.client.get(url, etag)
+            if r.status_code == 304:
+                data = stored
+            else:
+                data = [_trim_release(rel) for rel in r.json()]
+                if r.headers.get("ETag"):
+                    with _cache_lock:
+                        self.cache.set_page(page, r.headers["ETag"], data)
+
+            if "next" in r.links:
+                url = r.links["next"]["url"]
+            elif r.status_code == 304 and "Link" not in r.headers and len(data) == PER_PAGE:
+                url = f"{path}&page={page + 1}"
+            else:
+                url = None
+
+            self.count += len(data)
+            for rel in data:
+                assets = [(a["name"], a["browser_download_url"], a["digest"]) for a in rel["assets"]]
+                h.update(json.dumps([rel["id"], assets]).encode())
+                yield rel
+
+        with _cache_lock:
+            self.cache.truncate_pages(page)
+        self.fingerprint = h.hexdigest()
+
+
+class Hasher:
+    """
+    SHA-256 of a stream of chunks. With a pool, every chunk is hashed on the
+    pool while the caller reads the next one (hashlib releases the GIL for
+    large buffers), chunks are still hashed one after the other.
+    """
+
+    def __init__(self, pool: Executor | None = None):
+        self._h = hashlib.sha256()
+        self._pool = pool
+        self._pending: Future | None = None
+        self.seconds = 0.0
+
+    def _update(self, chunk: bytes):
+        start = time.perf_counter()
+        self._h.update(chunk)
+        self.seconds += time.perf_counter() - start
+
+    def update(self, chunk: bytes):
+        if self._pool is None:
+            return self._update(chunk)
+        if self._pending:
+            self._pending.result()
+        self._pending = self._pool.submit(self._update, chunk)
+
+    def digest(self) -> str:
+        if self._pending:
+            self._pending.result()
+            self._pending = None
+        return "sha256:" + self._h.hexdigest()
+
+
+def sha256(fp: BinaryIO, pool: Executor | None = None) -> str:
+    h = Hasher(pool)
+    for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+        h.update(chunk)
+    return h.digest()
+
+
+def _retryable(e: requests.RequestException, connect: bool = True) -> bool:
+    """
+    Whether a failed download is worth retrying: dropped connections, timeouts
+    and server errors are, other client errors are not. Failed connection
+    attempts only with connect, they are not worth another round after the
+    session already retried them.
+    """
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status >= 500 or status == 429
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    if isinstance(e, requests.ConnectTimeout) or isinstance(reason, ConnectTimeoutError):
+        # NewConnectionError is a ConnectTimeoutError as well
+        return connect
+    return isinstance(
+        e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+    )
+
+
+def download(
+    url: str,
+    fp: BinaryIO,
+    stats: dict | None = None,
+    pool: Executor | None = None,
+    hash_data: bool = True,
+    retries: int = 0,
+    session: requests.Session | None = None,
+) -> str | None:
+    """
+    Streams url into fp and returns the sha256 digest of the downloaded data,
+    hashed on pool if given. Returns None without hash_data.
+
+    Data already in fp (a partial download of an earlier run) is continued
+    with a range request. Dropped connections and server errors are retried
+    up to retries times with exponential backoff, again continuing after the
+    data received so far. Servers that ignore the range get downloaded from
+    the start. Failed connection attempts are only retried here without a
+    session, a session from make_session() retries them itself.
+
+    Uses session if given, so that connections are reused across downloads.
+    The number of bytes transferred, retries and the time spent hashing are added to stats.
+    """
+    h = Hasher(pool) if hash_data else None
+    written = fp.seek(0, os.SEEK_END)
+    if written and h:
+        fp.seek(0)
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
             h.update(chunk)
-    return "sha256:" + h.hexdigest()
+    transferred = 0
+    attempt = 0
+    try:
+        while True:
+            headers = {"Range": f"bytes={written}-"} if written else {}
+            try:
+                with (session or requests).get(
+                    url, headers=headers, stream=True, timeout=10
+                ) as r:
+                    # errors before a 416 is handled keep the data so far for the next attempt
+                    if r.status_code != 416 or not written:
+                        r.raise_for_status()
+                    if r.status_code == 206 and not written:
+                        # only part of the archive, although all of it was asked for
+                        raise requests.HTTPError(f"unexpected 206 for {url}", response=r)
+                    m = re.match(r"bytes (\d+)-", r.headers.get("Content-Range", ""))
+                    resumed = r.status_code == 206 and m and int(m.group(1)) == written
+                    if written and not resumed:
+                        # the data so far is unusable (416) or the server sent all of it (200)
+                        fp.seek(0)
+                        fp.truncate()
+                        written = 0
+                        h = Hasher(pool) if hash_data else None
+                        if r.status_code != 200:
+                            continue
+                    for chunk in r.iter_content(chunk_size=1024 * 1024):
+                        if chunk:
+                            if h:
+                                h.update(chunk)
+                            written += len(chunk)
+                            transferred += len(chunk)
+                            fp.write(chunk)
+                break
+            except requests.RequestException as e:
+                if attempt >= retries or not _retryable(e, connect=session is None):
+                    raise
+                delay = RETRY_BACKOFF * 2**attempt
+                attempt += 1
+                print(f"\tdownload of {url} failed ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+    finally:
+        if stats is not None:
+            stats["bytes"] += transferred
+            stats["retries"] += attempt
+            stats["hash_seconds"] += h.seconds if h else 0.0
+    return h.digest() if h else None
 
 
-def read_about_xml_from_zip(zip_path: Path) -> str | None:
+class ZipReadError(Exception):
     """
-    Returns the content of About/About.xml if present, otherwise None.
+    The zip archive cannot be read by scanning its central directory, or the
+    server does not honor range requests.
+    """
+
+
+# zip record layouts, see APPNOTE.TXT (same formats as in zipfile)
+_EOCD = struct.Struct("<4s4H2LH")
+_EOCD64_LOCATOR = struct.Struct("<4sLQL")
+_EOCD64 = struct.Struct("<4sQ2H2L4Q")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_EOCD_MAX_SIZE = _EOCD.size + 0xFFFF  # record plus the longest possible comment
+
+
+def _fetch_range(
+    url: str,
+    spec: str,
+    stats: dict | None = None,
+    session: requests.Session | None = None,
+) -> tuple[bytes, int]:
+    """
+    Fetch "bytes=<spec>" of url, returns the data and its absolute offset.
+    """
+    headers = {"Range": f"bytes={spec}"}
+    with (session or requests).get(url, headers=headers, stream=True, timeout=10) as r:
+        r.raise_for_status()
+        content_range = r.headers.get("Content-Range", "")
+        m = re.match(r"bytes (\d+)-\d+/", content_range)
+        if r.status_code != 206 or not m:
+            raise ZipReadError("server does not honor range requests")
+        if stats is not None:
+            stats["bytes"] += len(r.content)
+        return r.content, int(m.group(1))
+
+
+def _read_zip64_extra(extra: bytes, fields: list[int]) -> list[int]:
+    """
+    Replace the 0xFFFFFFFF placeholders in fields (size, compressed size,
+    header offset) with the values from the zip64 extra field.
+    """
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, size = struct.unpack_from("<2H", extra, pos)
+        if tag == 0x0001:
+            values = iter(struct.unpack_from(f"<{size // 8}Q", extra, pos + 4))
+            return [next(values) if f == 0xFFFFFFFF else f for f in fields]
+        pos += 4 + size
+    return fields
+
+
+def _find_central_entry(cd, name: bytes):
     """
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        name = "About/About.xml"
-        if name not in zf.namelist():
+    Scan a central directory buffer for the entry called name, stopping at
+    the first match. Returns (flags, method, crc, compressed_size, size,
+    header_offset) or None.
+    """
+    pos = 0
+    while pos + _CENTRAL_HEADER.size <= len(cd):
+        h = _CENTRAL_HEADER.unpack_from(cd, pos)
+        if h[0] != b"PK\x01\x02":
+            raise ZipReadError("corrupt central directory")
+        name_len, extra_len, comment_len = h[12], h[13], h[14]
+        start = pos + _CENTRAL_HEADER.size
+        if cd[start : start + name_len] == name:
+            extra = bytes(cd[start + name_len : start + name_len + extra_len])
+            size, csize, offset = _read_zip64_extra(extra, [h[11], h[10], h[18]])
+            return h[5], h[6], h[9], csize, size, offset
+        pos = start + name_len + extra_len + comment_len
+    return None
+
+
+def _inflate_entry(flags: int, method: int, crc: int, size: int, data) -> bytes:
+    if flags & 0x1:
+        raise ZipReadError("encrypted entry")
+    if method == zipfile.ZIP_DEFLATED:
+        data = zlib.decompressobj(-15).decompress(data)
+    elif method == zipfile.ZIP_STORED:
+        data = bytes(data)
+    else:
+        raise ZipReadError(f"unsupported compression method {method}")
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ZipReadError("CRC check failed")
+    return data
+
+
+def _read_zip_entry(tail, tail_offset: int, read, name: str) -> bytes | None:
+    """
+    Returns the content of the entry called name, None if there is none.
+
+    tail is the last _EOCD_MAX_SIZE bytes of the archive, starting at
+    tail_offset. read(offset, size) returns other parts of the archive.
+    """
+    try:
+        pos = tail.rfind(b"PK\x05\x06")
+        if pos < 0:
+            raise ZipReadError("no end of central directory record")
+        eocd = _EOCD.unpack_from(tail, pos)
+        cd_size, cd_offset = eocd[5], eocd[6]
+
+        locator_pos = pos - _EOCD64_LOCATOR.size
+        if locator_pos >= 0 and tail[locator_pos : locator_pos + 4] == b"PK\x06\x07":
+            locator = _EOCD64_LOCATOR.unpack_from(tail, locator_pos)
+            eocd64 = _EOCD64.unpack(read(locator[2], _EOCD64.size))
+            cd_size, cd_offset = eocd64[8], eocd64[9]
+
+        entry = _find_central_entry(read(cd_offset, cd_size), name.encode())
+        if entry is None:
             return None
-        with zf.open(name, "r") as fp:
-            return fp.read().decode("utf-8", errors="replace")
+        flags, method, crc, csize, size, offset = entry
+
+        # the local extra field may differ from the central one, read generously
+        guess = _LOCAL_HEADER.size + len(name) + 1024 + csize
+        data = read(offset, guess)
+        local = _LOCAL_HEADER.unpack_from(data)
+        if local[0] != b"PK\x03\x04":
+            raise ZipReadError("corrupt local file header")
+        start = _LOCAL_HEADER.size + local[10] + local[11]
+        if start + csize > len(data):
+            data = read(offset + start, csize)
+            start = 0
+        return _inflate_entry(flags, method, crc, size, data[start : start + csize])
+    except (struct.error, zlib.error) as e:
+        raise ZipReadError(str(e)) from e
+
+
+@contextlib.contextmanager
+def _zip_view(zip_file: Path | BinaryIO) -> Iterator[memoryview]:
+    """
+    Yields the content of zip_file without copying: the buffer of a BytesIO,
+    otherwise a memory map of the file, flushed first.
+    """
+    if isinstance(zip_file, io.BytesIO):
+        with zip_file.getbuffer() as view:
+            yield view
+        return
+    with contextlib.ExitStack() as stack:
+        if isinstance(zip_file, Path):
+            zip_file = stack.enter_context(zip_file.open("rb"))
+        else:
+            # a file that was just written may still have data in its buffer
+            zip_file.flush()
+        mm = stack.enter_context(mmap.mmap(zip_file.fileno(), 0, access=mmap.ACCESS_READ))
+        with memoryview(mm) as view:
+            yield view
+
+
+def read_about_xml_from_zip(zip_file: Path | BinaryIO) -> str | None:
+    """
+    Returns the content of About/About.xml if present, otherwise None.
+
+    The central directory is scanned in place up to the first match. Archives
+    the scanner cannot handle are read with zipfile.
+    """
+    scanned = False
+    try:
+        with _zip_view(zip_file) as view:
+            tail_offset = max(0, len(view) - _EOCD_MAX_SIZE)
+            try:
+                about = _read_zip_entry(
+                    bytes(view[tail_offset:]),
+                    tail_offset,
+                    lambda offset, size: view[offset : offset + size],
+                    ABOUT_XML,
+                )
+                scanned = True
+            except ZipReadError:
+                # handled below, outside of the view so that no slice of it outlives the map
+                pass
+    except (ValueError, OSError):
+        # empty file or no file descriptor to map
+        pass
+
+    if not scanned:
+        if not isinstance(zip_file, Path):
+            zip_file.seek(0)
+        with zipfile.ZipFile(zip_file, "r") as zf:
+            name = ABOUT_XML
+            if name not in zf.namelist():
+                return None
+            with zf.open(name, "r") as fp:
+                about = fp.read()
+    return about.decode("utf-8", errors="replace") if about is not None else None
+
+
+def read_about_xml_from_url(
+    url: str, stats: dict | None = None, session: requests.Session | None = None
+) -> str | None:
+    """
+    Returns the content of About/About.xml if present, otherwise None.
+
+    Only the end of central directory, the central directory and the entry
+    itself are fetched using HTTP range requests. Raises ZipReadError if
+    the server or the archive does not allow this.
+    """
+    tail, tail_offset = _fetch_range(url, f"-{_EOCD_MAX_SIZE}", stats, session)
+
+    def read(offset: int, size: int) -> bytes:
+        # the tail reaches up to the end of the archive
+        start = offset - tail_offset
+        if start >= 0:
+            return tail[start : start + size]
+        data, _ = _fetch_range(url, f"{offset}-{offset + size - 1}", stats, session)
+        return data
+
+    about = _read_zip_entry(tail, tail_offset, read, ABOUT_XML)
+    return about.decode("utf-8", errors="replace") if about is not None else None
+
 
+_LEADING_NUMBER = re.compile(r"^(\d+)(.*)$")
+_TRAILING_NUMBER = re.compile(r"^(.*?)(\d+)?$")
 
-def parse_version(s):
+VersionKey = tuple[tuple[tuple[str, int, str], ...], ...]
+
+
+def _cmp_key_str(x: str) -> str:
+    # OrdinalIgnoreCase equivalent for our purposes: case-insensitive compare
+    return (x or "").casefold()
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_part(part: str) -> tuple[str, int, str]:
+    part = part or ""
+    if not part:
+        return ("", 0, "")
+
+    # If starts with digit: prefix empty, parse leading digits as number, remainder as suffix
+    if part[0].isdigit():
+        m = _LEADING_NUMBER.match(part)
+        if m:
+            num_s, suffix = m.group(1), m.group(2)
+            num = int(num_s) if num_s else 0
+            return ("", num, _cmp_key_str(suffix))
+        return ("", 0, "")
+
+    # Otherwise: parse trailing digits as number (default 0 if none), rest is prefix
+    m = _TRAILING_NUMBER.match(part)
+    if m:
+        prefix, num_s = m.group(1), m.group(2)
+        num = int(num_s) if num_s else 0
+        return (_cmp_key_str(prefix), num, "")
+    return (_cmp_key_str(part), 0, "")
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_version(s: str) -> VersionKey:
+    """
+    Returns the sort key of a version string, nested tuples of
+    (prefix, number, suffix) per "-" separated part of each "." section.
+    """
     s = s.strip()
     if not s:
-        return [[("", 0, "")]]
+        return ((("", 0, ""),),)
 
     if s[0] in "vV":
         s = s[1:]
 
-    def _cmp_key_str(x: str) -> str:
-        # OrdinalIgnoreCase equivalent for our purposes: case-insensitive compare
-        return (x or "").casefold()
-
-    def _parse_part(part: str) -> tuple[str, int, str]:
-        part = part or ""
-        if not part:
-            return ("", 0, "")
-
-        # If starts with digit: prefix empty, parse leading digits as number, remainder as suffix
-        if part[0].isdigit():
-            m = re.match(r"^(\d+)(.*)$", part)
-            if m:
-                num_s, suffix = m.group(1), m.group(2)
-                num = int(num_s) if num_s else 0
-                return ("", num, _cmp_key_str(suffix))
-            return ("", 0, "")
-
-        # Otherwise: parse trailing digits as number (default 0 if none), rest is prefix
-        m = re.match(r"^(.*?)(\d+)?$", part)
-        if m:
-            prefix, num_s = m.group(1), m.group(2)
-            num = int(num_s) if num_s else 0
-            return (_cmp_key_str(prefix), num, "")
-        return (_cmp_key_str(part), 0, "")
-
-    sections: list[list[tuple[str, int, str]]] = []
-    for section in s.split("."):
-        parts = [_parse_part(p) for p in section.split("-")]
-        sections.append(parts)
-
-    return sections
-
-
-def get_release_data() -> list:
-    owner, repo = os.environ["GITHUB_REPOSITORY"].strip().split("/", 1)
-    return (
-        github(
-            [
-                "api",
-                f"/repos/{owner}/{repo}/releases",
-                "--paginate",
-            ]
-        )
-        or []
+    return tuple(tuple(_parse_part(p) for p in section.split("-")) for section in s.split("."))
+
+
+def _trim_release(rel: dict) -> dict:
+    """
+    Keep only the release fields used for the build.
+    """
+    return {
+        "id": rel.get("id"),
+        "tag_name": rel.get("tag_name"),
+        "assets": [
+            {k: a.get(k) for k in ("name", "browser_download_url", "digest", "size")}
+            for a in rel.get("assets") or []
+        ],
+    }
+
+
+def get_release_data(
+    cache: MetadataCache, session: requests.Session | None = None
+) -> ReleaseListing:
+    repository = os.environ["GITHUB_REPOSITORY"].strip()
+    return ReleaseListing(GitHubClient(session=session), cache, repository)
+
+
+def fetch_asset(
+    name: str,
+    url: str,
+    digest: str,
+    options: FetchOptions,
+    stats: dict,
+    size: int | None = None,
+) -> ModMetadata | None:
+    """
+    Reads the ModMetadata of a zip asset that is not in the cache, None if it has no About.xml.
+    """
+    start = time.perf_counter()
+    fetched = False
+    blobs = options.blobs if options.blobs and options.blobs.path(digest) else None
+    stored = blobs.open(digest) if blobs else None
+    if stored:
+        # verified against the digest when opened
+        print(f"\treusing stored blob for {name}")
+        with stored, _reading_archive():
+            about_xml = read_about_xml_from_zip(stored)
+        stats["parse_seconds"] = time.perf_counter() - start
+        fetched = True
+    elif options.remote_zip:
+        # the digest is taken from the release listing, nothing to hash locally
+        try:
+            about_xml = read_about_xml_from_url(url, stats, options.session)
+            fetched = True
+        except ZipReadError as e:
+            print(f"\tcannot read {name} remotely ({e}), downloading it")
+        stats["download_seconds"] = time.perf_counter() - start
+
+    if not fetched:
+        # hash while downloading and read About.xml from the same buffer,
+        # only archives larger than SPOOL_SIZE end up on disk
+        if blobs:
+            buffer = blobs.add(digest)
+        elif size is not None and size <= SPOOL_SIZE:
+            buffer = io.BytesIO()
+        else:
+            buffer = tempfile.TemporaryFile()
+        with buffer as fp:
+            local_digest = download(
+                url,
+                fp,
+                stats,
+                options.hash_pool,
+                options.digest_mode == "verify",
+                options.retries,
+                options.session,
+            )
+            if local_digest and local_digest != digest:
+                raise DigestMismatchError(
+                    f"downloaded {name} has digest {local_digest}, the release lists {digest}"
+                )
+            stats["download_seconds"] = time.perf_counter() - start
+            start = time.perf_counter()
+            with _reading_archive():
+                about_xml = read_about_xml_from_zip(fp)
+            stats["parse_seconds"] = time.perf_counter() - start
+
+    if not about_xml:
+        return None
+
+    start = time.perf_counter()
+    with _reading_archive():
+        mm = ModMetadata.from_about_xml(about_xml, url, digest)
+    stats["parse_seconds"] = stats.get("parse_seconds", 0.0) + time.perf_counter() - start
+    mm.url = url
+    print(
+        f"\tfound mod id={mm.id}, name={mm.name}, version={mm.version}, branch={list(mm.branch)}"
     )
+    return mm
 
 
-def handle_asset(asset: dict, cache: dict, all_zip_digests: set) -> ModMetadata | None:
+def handle_asset(
+    asset: dict,
+    cache: MetadataCache,
+    all_zip_digests: set,
+    options: FetchOptions | None = None,
+    metrics: "Metrics | None" = None,
+) -> ModMetadata | None:
     name = asset.get("name", "")
     url = asset.get("browser_download_url", "")
     if not name.lower().endswith(".zip"):
@@ -186,62 +1079,410 @@ def handle_asset(asset: dict, cache: dict, all_zip_digests: set) -> ModMetadata
     if not digest:
         return
 
-    all_zip_digests.add(digest)
-    if digest in cache:
-        metadata = cache[digest]
+    stats = (metrics or Metrics()).asset(name, digest)
+    with _cache_lock:
+        all_zip_digests.add(digest)
+        metadata = cache.get(digest)
+        # single flight: only the first asset with a digest fetches it,
+        # assets with the same digest wait for its result
+        flight = None
+        if metadata is None:
+            flight = _in_flight.get(digest)
+            leader = flight is None
+            if leader:
+                flight = _in_flight[digest] = Future()
+    if metadata is None and not leader:
+        metadata = flight.result()
+    if metadata is not None:
+        stats["cache"] = "hit"
+        if isinstance(metadata, str):
+            raise InvalidAssetError(metadata)
         if not metadata:
             return
 
-        mm = ModMetadata(**metadata)
+        # the asset's own url, not the one of the asset the metadata was read from
+        mm = ModMetadata.from_cache(metadata, url)
         print(
-            f"\tfound mod in cache: id={mm.id}, name={mm.name}, version={mm.version}, branch={mm.branch}"
+            f"\tfound mod in cache: id={mm.id}, name={mm.name}, version={mm.version}, branch={list(mm.branch)}"
         )
         return mm
 
-    # Download asset to temp dir using requests
-    outdir = Path("_downloads") / f"asset_{digest.replace(':', '_')}"
-    outdir.mkdir(parents=True, exist_ok=True)
+    stats["cache"] = "miss"
+    try:
+        mm = fetch_asset(
+            name, url, digest, options or FetchOptions(), stats, asset.get("size")
+        )
+    except InvalidAssetError as e:
+        mm = None
+        metadata = str(e)
+    except BaseException as e:
+        with _cache_lock:
+            del _in_flight[digest]
+        flight.set_exception(e)
+        raise
+    else:
+        metadata = mm.to_cache() if mm else False
 
-    zip_path = outdir / name
-    with requests.get(url, stream=True, timeout=10) as r:
-        r.raise_for_status()
-        with zip_path.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                if chunk:
-                    f.write(chunk)
+    with _cache_lock:
+        cache[digest] = metadata
+        del _in_flight[digest]
+    flight.set_result(metadata)
+    if isinstance(metadata, str):
+        raise InvalidAssetError(metadata)
+    return mm
 
-    about_xml = read_about_xml_from_zip(zip_path)
-    if not about_xml:
-        cache[digest] = False
-        return
 
-    mm = ModMetadata.from_about_xml(about_xml, url, digest)
-    mm.digest = sha256(zip_path)
-    mm.url = url
-    print(
-        f"\tfound mod id={mm.id}, name={mm.name}, version={mm.version}, branch={mm.branch}"
+# escapes of attribute values as written by libxml2
+_ATTRIB_ESCAPES = str.maketrans(
+    {
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "\r": "&#13;",
+        "\n": "&#10;",
+        "\t": "&#9;",
+    }
+)
+
+# ModVersion attributes, in the order written to modrepo.xml
+_MODVERSION_ATTRS = ("ModID", "Version", "Name", "Author", "Url", "Digest")
+
+
+class XmlCheckError(Exception):
+    """
+    A written XML file is not well-formed or does not contain what was written to it.
+    """
+
+
+def _write_start(f, level: int, name: str, attrs, empty: bool):
+    """
+    Writes a start tag laid out like "xmllint --pretty 2": every attribute
+    on a line of its own, the closing > or /> on the next line.
+    """
+    f.write(f"{'  ' * level}<{name}")
+    for key, value in attrs:
+        f.write(f'\n{"  " * (level + 2)}{key}="{value.translate(_ATTRIB_ESCAPES)}"')
+    if empty:
+        f.write(f"\n{'  ' * level}/>\n")
+    else:
+        f.write(f"\n{'  ' * (level + 1)}>\n")
+
+
+def _write_end(f, level: int, name: str):
+    f.write(f"{'  ' * level}</{name}\n{'  ' * level}>\n")
+
+
+def _modversion_attrs(mm: ModMetadata) -> tuple[tuple[str, str], ...]:
+    return tuple(
+        zip(_MODVERSION_ATTRS, (mm.id, mm.version, mm.name, mm.author, mm.url, mm.digest))
     )
-    cache[digest] = dict(mm.__dict__)
-    return mm
 
 
-def main():
-    # This runs during a GitHub Action workflow. Ensure GH CLI auth via:
-    #   env: GH_TOKEN: ${{ github.token }}
+def _modversion_record(attrs: dict, branches: list[str]) -> dict:
+    record = {key: attrs.get(key, "") for key in _MODVERSION_ATTRS}
+    record["Branches"] = list(branches)
+    return record
 
-    cache_file = Path("modrepo_cache.json")
-    cache = json.loads(cache_file.read_text()) if cache_file.exists() else {}
 
-    print("Cache entries:", len(cache))
+def read_modrepo(path: Path) -> list[dict] | None:
+    """
+    Returns the ModVersions of an existing modrepo.xml as records like the
+    ones of the delta feed, [] if there is none and None if it cannot be parsed.
+    """
+    if not path.exists():
+        return []
+    try:
+        root = ET.parse(path).getroot()
+    except ET.ParseError as e:
+        print(f"Cannot parse {path}: {e}")
+        return None
+    return [
+        _modversion_record(elem.attrib, [b.get("Value", "") for b in elem.iter("Branch")])
+        for elem in root.iter("ModVersion")
+    ]
 
-    releases = get_release_data()
 
-    print(f"Loaded {len(releases)} new releases")
+def write_modrepo(path: Path, entries: list[ModMetadata]):
+    """
+    Writes the ModVersion elements of entries to path one by one.
 
-    entries: list[ModMetadata] = []
+    The output is byte-identical to "xmllint --pretty 2" of the document, so
+    it is published as is. The written file is parsed again one ModVersion at
+    a time and compared with entries, XmlCheckError is raised if it is not
+    well-formed or differs.
+    """
+    with path.open("w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        _write_start(f, 0, "ModRepo", (), empty=not entries)
+        for mm in entries:
+            _write_start(f, 1, "ModVersion", _modversion_attrs(mm), empty=not mm.branch)
+            if mm.branch:
+                for branch in mm.branch:
+                    _write_start(f, 2, "Branch", (("Value", branch),), empty=True)
+                _write_end(f, 1, "ModVersion")
+        if entries:
+            _write_end(f, 0, "ModRepo")
 
-    all_zip_digests = set()
+    mismatch = XmlCheckError(f"{path} does not read back as the entries written to it")
+    expected = iter(entries)
+    root = None
+    try:
+        for event, elem in ET.iterparse(path, events=("start", "end")):
+            if root is None:
+                root = elem
+            if event != "end" or elem.tag != "ModVersion":
+                continue
+            mm = next(expected, None)
+            written = _modversion_record(
+                elem.attrib, [b.get("Value", "") for b in elem.iter("Branch")]
+            )
+            # drops the ModVersions checked so far
+            root.clear()
+            if mm is None or written != _modversion_record(dict(_modversion_attrs(mm)), mm.branch):
+                raise mismatch
+    except ET.ParseError as e:
+        raise XmlCheckError(f"{path} is not well-formed: {e}") from e
+    if next(expected, None) is not None:
+        raise mismatch
+
+
+def _shard_name(mod_id: str, used: set[str]) -> str:
+    """
+    File name for the shard of mod_id. ModIDs that are not safe as a file
+    name, or that clash with another one on a case-insensitive file system,
+    get a suffix derived from the ModID.
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", mod_id).strip(".") or "_"
+    if name != mod_id or name.casefold() in used or name.casefold() == "index":
+        name += "-" + hashlib.sha256(mod_id.encode("utf-8")).hexdigest()[:8]
+    used.add(name.casefold())
+    return name + ".xml"
+
+
+def write_shards(root: Path, entries: list[ModMetadata]):
+    """
+    Writes the ModVersions of every ModID to a file of its own in root, in
+    the format of modrepo.xml, and root/index.xml listing every ModID with
+    its latest version and the path of its file relative to root. Shards
+    listed in the previous index.xml that are not written again, e.g. of
+    removed mods, are deleted. Other files in root are left alone.
+
+    entries must be sorted like modrepo.xml, by ModID and then by version.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    previous = set()
+    try:
+        for _, elem in ET.iterparse(root / "index.xml"):
+            if elem.tag == "Mod" and Path(elem.get("Path", "")).name == elem.get("Path"):
+                previous.add(elem.get("Path"))
+    except (OSError, ET.ParseError):
+        pass
+
+    used: set[str] = set()
+    index = []
+    for mod_id, versions in itertools.groupby(entries, key=lambda mm: mm.id):
+        versions = list(versions)
+        name = _shard_name(mod_id, used)
+        write_modrepo(root / name, versions)
+        index.append((versions[-1], name, len(versions)))
+
+    with (root / "index.xml").open("w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        _write_start(f, 0, "ModIndex", (), empty=not index)
+        for latest, name, count in index:
+            attrs = (
+                ("ModID", latest.id),
+                ("Version", latest.version),
+                ("Name", latest.name),
+                ("Path", name),
+                ("Versions", str(count)),
+            )
+            _write_start(f, 1, "Mod", attrs, empty=True)
+        if index:
+            _write_end(f, 0, "ModIndex")
+
+    for name in previous - {name for _, name, _ in index} - {"index.xml"}:
+        (root / name).unlink(missing_ok=True)
+
+
+def _last_sequence(feed: Path) -> int:
+    if not feed.exists():
+        return 0
+    with feed.open("rb") as f:
+        # records are far shorter than this
+        f.seek(max(0, f.seek(0, os.SEEK_END) - 65536))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        if line.strip():
+            return json.loads(line)["seq"]
+    return 0
+
+
+def append_delta_feed(feed: Path, previous: list[dict], entries: list[ModMetadata]) -> int:
+    """
+    Appends a record for every ModVersion that was removed from or added to
+    modrepo.xml since previous to feed, one JSON object per line, and
+    returns the number of records. Records carry the ModVersion attributes,
+    its branches, "op" ("remove" or "add") and a "seq" number one higher
+    than the last record in the feed, so clients can read on from the last
+    sequence number they have seen.
+
+    A ModVersion whose attributes or branches changed is removed and added again.
+    """
+    current = [_modversion_record(dict(_modversion_attrs(mm)), mm.branch) for mm in entries]
+
+    def keyed(records: list[dict]) -> dict[str, dict]:
+        return {json.dumps(r, sort_keys=True): r for r in records}
+
+    before, after = keyed(previous), keyed(current)
+    changes = [("remove", r) for key, r in before.items() if key not in after]
+    changes += [("add", r) for key, r in after.items() if key not in before]
+    if not changes:
+        return 0
+
+    seq = _last_sequence(feed)
+    with feed.open("a", encoding="utf-8") as f:
+        for op, record in changes:
+            seq += 1
+            line = {"seq": seq, "op": op, **record}
+            f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+    return len(changes)
+
+
+# file suffix of every supported compression of modrepo.xml
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _zstd_compress(data: bytes) -> bytes | None:
+    """
+    zstd level 19 with compression.zstd (Python 3.14+) or the zstandard
+    package, None if neither is available.
+    """
+    try:
+        from compression import zstd
+
+        return zstd.compress(data, level=19)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard.ZstdCompressor(level=19).compress(data)
 
+
+def write_compressed(path: Path, formats: list[str]) -> list[Path]:
+    """
+    Writes compressed copies of path next to it, <path>.gz and <path>.zst.
+    Returns the files written, zstd is left out if no zstd module is available.
+    Copies that are not written are removed, so that none is left stale.
+
+    The output only depends on the content of path: the gzip header has no
+    file name and a zero mtime, so an unchanged modrepo.xml gives an
+    unchanged modrepo.xml.gz.
+    """
+    data = path.read_bytes()
+    written = []
+    for fmt in formats:
+        if fmt == "gzip":
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        else:
+            compressed = _zstd_compress(data)
+            if compressed is None:
+                print("zstd is not available, install zstandard to write", path.name + ".zst")
+                continue
+        target = path.with_name(path.name + COMPRESSED_SUFFIXES[fmt])
+        target.write_bytes(compressed)
+        written.append(target)
+    for suffix in COMPRESSED_SUFFIXES.values():
+        target = path.with_name(path.name + suffix)
+        if target not in written:
+            target.unlink(missing_ok=True)
+    return written
+
+
+class Metrics:
+    """
+    Timings of the phases of a build and of every zip asset it handled.
+    """
+
+    def __init__(self):
+        self.phases: dict[str, dict] = {}
+        self.assets: list[dict] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = {"seconds": time.perf_counter() - start}
+
+    def asset(self, name: str, digest: str) -> dict:
+        """
+        Returns a new record for an asset, to be filled in while it is handled.
+        """
+        stats = {
+            "name": name,
+            "digest": digest,
+            "cache": None,
+            "bytes": 0,
+            "retries": 0,
+            "download_seconds": 0.0,
+            "hash_seconds": 0.0,
+            "parse_seconds": 0.0,
+        }
+        with self._lock:
+            self.assets.append(stats)
+        return stats
+
+    def totals(self) -> dict:
+        totals = {
+            "assets": len(self.assets),
+            "cache_hits": sum(a["cache"] == "hit" for a in self.assets),
+            "cache_misses": sum(a["cache"] == "miss" for a in self.assets),
+        }
+        for key in ("bytes", "retries", "download_seconds", "hash_seconds", "parse_seconds"):
+            totals[key] = sum(a[key] for a in self.assets)
+        return totals
+
+    def write_json(self, path: Path):
+        data = {"phases": self.phases, "totals": self.totals(), "assets": self.assets}
+        path.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+
+    def summary(self) -> str:
+        lines = [f"{'phase':<20}{'seconds':>10}"]
+        for name, phase in self.phases.items():
+            lines.append(f"{name:<20}{phase['seconds']:>10.3f}")
+        totals = self.totals()
+        lines += [
+            "",
+            f"assets: {totals['assets']}, cache hits: {totals['cache_hits']},"
+            f" cache misses: {totals['cache_misses']}",
+            f"downloaded {totals['bytes'] / (1 << 20):.1f} MiB"
+            f" in {totals['download_seconds']:.3f}s (summed over all downloads),"
+            f" hashing {totals['hash_seconds']:.3f}s, parsing {totals['parse_seconds']:.3f}s",
+        ]
+        if totals["retries"]:
+            lines.append(f"retried downloads {totals['retries']} times")
+        slowest = sorted(self.assets, key=lambda a: a["download_seconds"], reverse=True)[:5]
+        if slowest and slowest[0]["download_seconds"]:
+            lines.append("slowest downloads:")
+            for a in slowest:
+                if a["download_seconds"]:
+                    lines.append(
+                        f"  {a['name']:<40}{a['download_seconds']:>8.3f}s"
+                        f"{a['bytes'] / (1 << 20):>10.1f} MiB"
+                    )
+        return "\n".join(lines)
+
+
+def _zip_release_assets(releases: ReleaseListing) -> Iterator[tuple[str, dict]]:
+    """
+    Yields (tag, asset) for every asset of the releases that have a zip asset.
+    """
     for rel in releases:
         tag = rel.get("tag_name")
         assets = rel.get("assets") or []
@@ -253,45 +1494,354 @@ def main():
 
         print("handling release:", tag)
 
-        assets = rel.get("assets") or []
         for asset in assets:
-            try:
-                mm = handle_asset(asset, cache, all_zip_digests)
-                if mm:
-                    entries.append(mm)
-            except Exception as e:
-                print(f"Error handling asset {asset.get('name')} in release {tag}: {e}")
-
-    # write modrepo.xml
-    modrepo = ET.Element("ModRepo")
-
-    entries.sort(key=lambda t: (t.id, t.version_parsed, t.branch))
-
-    for mm in entries:
-        mv = ET.SubElement(modrepo, "ModVersion")
-        mv.set("ModID", mm.id)
-        mv.set("Version", mm.version)
-        mv.set("Name", mm.name)
-        mv.set("Author", mm.author)
-        mv.set("Url", mm.url)
-        mv.set("Digest", mm.digest)
-
-        for branch in mm.branch:
-            b = ET.SubElement(mv, "Branch")
-            b.set("Value", branch)
-
-    ET.indent(modrepo, space="  ", level=0)
-    xml_str = ET.tostring(modrepo, encoding="unicode")
-
-    # Add XML header for readability/compatibility if consumers expect it
-    xml_out = '<?xml version="1.0" encoding="utf-8"?>\n' + xml_str + "\n"
-    Path("modrepo.xml").write_text(xml_out, encoding="utf-8")
-
-    # remove cache entries for zip files no longer present
-    removed_digests = set(cache.keys()) - all_zip_digests
-    for digest in removed_digests:
-        del cache[digest]
-    cache_file.write_text(json.dumps(cache, indent=4, sort_keys=True), encoding="utf-8")
+            yield tag, asset
+
+
+def _listing_unchanged(releases: ReleaseListing, cache: MetadataCache) -> bool:
+    print(f"Loaded {releases.count} releases")
+    with _cache_lock:
+        unchanged = releases.fingerprint == cache.get_state("fingerprint")
+    return unchanged and Path("modrepo.xml").exists()
+
+
+def fetch_assets_threaded(
+    releases: ReleaseListing,
+    cache: MetadataCache,
+    all_zip_digests: set,
+    options: FetchOptions,
+    metrics: Metrics,
+    jobs: int,
+) -> tuple[list, bool]:
+    """
+    Handles all assets on a pool of jobs threads. Returns the (tag, asset,
+    future) of every asset in listing order once all are done, and whether
+    the listing is unchanged since the last build, in which case nothing was
+    fetched.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        # downloads already start while later pages are listed
+        with metrics.phase("list releases"):
+            pending = []
+            for tag, asset in _zip_release_assets(releases):
+                future = pool.submit(handle_asset, asset, cache, all_zip_digests, options, metrics)
+                pending.append((tag, asset, future))
+
+        # the fingerprint is only stored once every asset has a cache entry, so the
+        # pending lookups of an unchanged listing are cache hits and can be dropped
+        if _listing_unchanged(releases, cache):
+            pool.shutdown(cancel_futures=True)
+            return [], True
+
+        with metrics.phase("fetch assets"):
+            concurrent.futures.wait([future for _, _, future in pending])
+    return pending, False
+
+
+async def fetch_assets_asyncio(
+    releases: ReleaseListing,
+    cache: MetadataCache,
+    all_zip_digests: set,
+    options: FetchOptions,
+    metrics: Metrics,
+    jobs: int,
+) -> tuple[list, bool]:
+    """
+    Same as fetch_assets_threaded, as a pipeline of asyncio tasks: one lists
+    the releases page by page and feeds a bounded queue of assets, which jobs
+    tasks consume. The listing only runs ahead of the downloads by the queue
+    size. The blocking parts (requests, hashing, sqlite) run on threads.
+
+    Both stages are timed together as the phase "list + fetch assets".
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=jobs)
+    pending = []
+
+    with (
+        ThreadPoolExecutor(max_workers=jobs) as pool,
+        ThreadPoolExecutor(max_workers=1, thread_name_prefix="list") as lister,
+    ):
+
+        async def consume():
+            while (item := await queue.get()) is not None:
+                tag, asset = item
+                future = pool.submit(handle_asset, asset, cache, all_zip_digests, options, metrics)
+                # appended right after taking it from the queue, so in listing order
+                pending.append((tag, asset, future))
+                with contextlib.suppress(Exception):
+                    await asyncio.wrap_future(future)
+
+        consumers = [asyncio.create_task(consume()) for _ in range(jobs)]
+        # listing waits for room in the queue, so it cannot be timed apart from fetching
+        with metrics.phase("list + fetch assets"):
+            assets = _zip_release_assets(releases)
+            while (item := await loop.run_in_executor(lister, next, assets, None)) is not None:
+                await queue.put(item)
+
+            if _listing_unchanged(releases, cache):
+                pool.shutdown(cancel_futures=True)
+                for task in consumers:
+                    task.cancel()
+                await asyncio.gather(*consumers, return_exceptions=True)
+                return [], True
+
+            for _ in consumers:
+                await queue.put(None)
+            await asyncio.gather(*consumers)
+    return pending, False
+
+
+def _compression_formats(s: str) -> list[str]:
+    formats = [f.strip() for f in s.split(",") if f.strip()]
+    for fmt in formats:
+        if fmt not in COMPRESSED_SUFFIXES:
+            raise argparse.ArgumentTypeError(
+                f"unknown compression {fmt!r}, choose from {', '.join(COMPRESSED_SUFFIXES)}"
+            )
+    return formats
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Build modrepo.xml from the releases of $GITHUB_REPOSITORY"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=8,
+        help="number of assets downloaded concurrently (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="threads: list all releases while a thread pool fetches the assets, asyncio: "
+        "pipeline listing and fetching through a bounded queue (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--hash-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="threads hashing downloaded data alongside the downloads, 0 hashes "
+        "on the downloading thread (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--digest",
+        dest="digest_mode",
+        choices=["verify", "trust"],
+        default="verify",
+        help="verify: hash downloads and fail on a mismatch with the digest from the "
+        "release listing, trust: use that digest without hashing (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="retry dropped or failed downloads this many times with exponential backoff, "
+        "continuing after the data received so far (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--http-pool-size",
+        type=int,
+        default=0,
+        metavar="N",
+        help="connections kept alive per host, 0 for one per job (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        dest="keep_alive",
+        action="store_false",
+        help="open a new connection for every request",
+    )
+    parser.add_argument(
+        "--remote-zip",
+        action="store_true",
+        help="read About.xml with HTTP range requests instead of downloading whole "
+        "archives, trusting the digest from the release listing",
+    )
+    parser.add_argument(
+        "--blob-store",
+        type=Path,
+        metavar="DIR",
+        help="keep downloaded archives in DIR, keyed by digest, and reuse them in later runs",
+    )
+    parser.add_argument(
+        "--blob-store-size",
+        type=float,
+        default=10,
+        metavar="GIB",
+        help="evict the least recently used archives beyond this size (default: %(default)s GiB)",
+    )
+    parser.add_argument(
+        "--compress",
+        type=_compression_formats,
+        default="gzip",
+        metavar="FORMATS",
+        help="comma-separated compressed copies of modrepo.xml to write next to it: "
+        "gzip (modrepo.xml.gz), zstd (modrepo.xml.zst, if zstandard is installed), "
+        'or "" for none (default: %(default)s)',
+    )
+    parser.add_argument(
+        "--shards",
+        type=Path,
+        metavar="DIR",
+        help="also write the versions of every ModID to DIR/<ModID>.xml and an index "
+        "of all ModIDs with their latest version to DIR/index.xml; DIR must not be "
+        "the current directory",
+    )
+    parser.add_argument(
+        "--delta-feed",
+        type=Path,
+        metavar="FILE",
+        help="append the ModVersions added to and removed from modrepo.xml by this "
+        "build to FILE as JSON lines with increasing sequence numbers",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        metavar="FILE",
+        help="write phase and per-asset timings as JSON to FILE",
+    )
+    args = parser.parse_args(argv)
+    if args.shards and args.shards.resolve() == Path.cwd().resolve():
+        parser.error("--shards needs a directory of its own, not the one of modrepo.xml")
+    return args
+
+
+def set_output(name: str, value: str):
+    """
+    Sets an output of the current GitHub Actions step.
+    """
+    if "GITHUB_OUTPUT" in os.environ:
+        with open(os.environ["GITHUB_OUTPUT"], "a", encoding="utf-8") as f:
+            f.write(f"{name}={value}\n")
+
+
+def build(args: argparse.Namespace, metrics: Metrics) -> bool:
+    """
+    Builds modrepo.xml, returns False if it was skipped because no release changed.
+    """
+    with metrics.phase("load cache"):
+        cache = MetadataCache(Path("modrepo_cache.db"))
+        legacy_cache_file = Path("modrepo_cache.json")
+        if legacy_cache_file.exists():
+            cache.migrate_json(legacy_cache_file)
+
+    print("Cache entries:", len(cache))
+
+    if args.shards and not (args.shards / "index.xml").exists():
+        # the shards are written from the entries, so an unchanged build cannot add them
+        cache.set_state("fingerprint", None)
+
+    # one connection per download thread plus one for the release listing
+    session = make_session(
+        args.http_pool_size or max(1, args.jobs) + 1, args.retries, args.keep_alive
+    )
+    releases = get_release_data(cache, session)
+
+    options = FetchOptions(
+        remote_zip=args.remote_zip,
+        digest_mode=args.digest_mode,
+        retries=args.retries,
+        session=session,
+    )
+    if args.hash_workers > 0 and args.digest_mode == "verify":
+        options.hash_pool = ThreadPoolExecutor(args.hash_workers, thread_name_prefix="hash")
+    if args.blob_store:
+        options.blobs = BlobStore(
+            args.blob_store,
+            int(args.blob_store_size * (1 << 30)),
+            options.hash_pool,
+            verify=args.digest_mode == "verify",
+        )
+
+    all_zip_digests = set()
+
+    # Uncached assets are fetched concurrently; results are collected in
+    # listing order so that entries keep the same order as a sequential run.
+    jobs = max(1, args.jobs)
+    if args.engine == "asyncio":
+        pending, unchanged = asyncio.run(
+            fetch_assets_asyncio(releases, cache, all_zip_digests, options, metrics, jobs)
+        )
+    else:
+        pending, unchanged = fetch_assets_threaded(
+            releases, cache, all_zip_digests, options, metrics, jobs
+        )
+
+    entries: list[ModMetadata] = []
+    failed = False
+    for tag, asset, future in pending:
+        try:
+            mm = future.result()
+            if mm:
+                entries.append(mm)
+        except InvalidAssetError as e:
+            # shown as an error annotation on the workflow run, the error is
+            # cached since retrying the same archive would fail the same way
+            print(f"::error::Asset {asset.get('name')} in release {tag}: {e}")
+        except Exception as e:
+            # e.g. network errors, the asset has no cache entry
+            failed = True
+            print(f"Error handling asset {asset.get('name')} in release {tag}: {e}")
+
+    session.close()
+    if options.hash_pool:
+        options.hash_pool.shutdown()
+    if options.blobs:
+        removed = options.blobs.evict()
+        if removed:
+            print(f"Evicted {removed} archives from {options.blobs.root}")
+
+    if unchanged:
+        cache.close()
+        # e.g. the first run after enabling or disabling a compression
+        copies = {fmt: Path("modrepo.xml" + suffix) for fmt, suffix in COMPRESSED_SUFFIXES.items()}
+        before = {fmt for fmt, copy in copies.items() if copy.exists()}
+        if before != set(args.compress):
+            write_compressed(Path("modrepo.xml"), args.compress)
+            if before != {fmt for fmt, copy in copies.items() if copy.exists()}:
+                print("Releases unchanged since the last build, updated compressed modrepo.xml")
+                return True
+        print("Releases unchanged since the last build, nothing to do")
+        return False
+
+    with metrics.phase("write xml"):
+        entries.sort(key=lambda t: (t.id, t.version_parsed, t.branch))
+        previous = read_modrepo(Path("modrepo.xml")) if args.delta_feed else None
+        write_modrepo(Path("modrepo.xml"), entries)
+        if previous is not None:
+            changes = append_delta_feed(args.delta_feed, previous, entries)
+            print(f"Appended {changes} changes to {args.delta_feed}")
+        write_compressed(Path("modrepo.xml"), args.compress)
+        if args.shards:
+            write_shards(args.shards, entries)
+
+    with metrics.phase("save cache"):
+        # remove cache entries for zip files no longer present
+        cache.prune(all_zip_digests)
+        # without a fingerprint the next run rebuilds and retries the assets that have no cache entry
+        cache.set_state("fingerprint", None if failed else releases.fingerprint)
+        cache.commit()
+        cache.close()
+    return True
+
+
+def main(argv: list[str] | None = None, metrics: Metrics | None = None):
+    # This runs during a GitHub Action workflow. Ensure API auth via:
+    #   env: GH_TOKEN: ${{ github.token }}
+    args = parse_args(argv)
+    metrics = metrics or Metrics()
+    try:
+        changed = build(args, metrics)
+        set_output("changed", "true" if changed else "false")
+    finally:
+        print()
+        print(metrics.summary())
+        if args.metrics:
+            metrics.write_json(args.metrics)
 
 
 if __name__ == "__main__":